@@ -32,6 +32,8 @@ class BackupInfo(object):
             self.settings = {}
             self.extra_kvids = {}
             self.extra_xids = {}
+            # xid -> decoded extra data, shared by all files using it
+            self._file_extra_data = {}
             self.directories = {}
             self.directories[0] = DirectoryData(None, None)
             self.files = []
@@ -102,26 +104,27 @@ class BackupInfo(object):
             self._decode_extra_data(extra_data))
 
     def _add_file(self, item):
-        mtime = (
-            datetime.datetime(item.mtime_year, 1, 1) +
-            datetime.timedelta(
-                seconds=item.mtime_second, microseconds=item.mtime_ns//1000))
         if item.kind == 'file':
             filetype = 'file'
         elif item.kind.startswith('file-'):
             filetype = item.kind[5:]
         else:
             raise UnreachableError()
+        extra_data = self._file_extra_data.get(item.extra_data)
+        if extra_data is None:
+            extra_data = self._decode_extra_data(item.extra_data)
+            self._file_extra_data[item.extra_data] = extra_data
         self.files.append(
             FileData(
                 valuecodecs.bytes_to_path_component(item.name),
                 item.parent,
                 item.cid,
                 item.size,
-                mtime,
+                item.mtime_year,
+                item.mtime_second,
                 item.mtime_ns,
                 filetype,
-                self._decode_extra_data(item.extra_data)))
+                extra_data))
 
     def _decode_extra_data(self, xid):
         if xid == 0:
@@ -276,93 +279,59 @@ class DirectoryData(object):
         self.files = {}
 
 class FileData(object):
-    # The information stored in a FileData object is encoded as a
-    # string in the _data member. This saves a lot of memory over
-    # storing each item in a dict. Though at some cost to performance.
-    __slots__ = ('_data', 'name')
+    # One object is kept for every file in the backup, so the fields
+    # are stored in slots rather than in a per-object dict, and the
+    # mtime is kept as the year and second-of-year packed into a
+    # single int (see BackupInfo._add_file) rather than as a datetime.
+    # Files with the same extra data share a single extra-data dict.
+    # The fields are exposed as read-only properties, since the same
+    # FileData is handed to every caller, and 'extra_data' returns a
+    # copy.
+    __slots__ = (
+        'name', '_parentid', '_contentid', '_size', '_mtime',
+        '_mtime_nsec', '_filetype', '_extra_data')
 
     def __init__(
-            self, name, parentid, contentid, size, mtime, mtime_nsec,
-            filetype, extra_data):
+            self, name, parentid, contentid, size, mtime_year,
+            mtime_second, mtime_nsec, filetype, extra_data):
         self.name = name
-        mtimestr = (
-            str(mtime.year) + '.' + str(mtime.month) + '.' + str(mtime.day) +
-            '.' + str(mtime.hour) + '.' + str(mtime.minute) + '.' +
-            str(mtime.second) + '.' + str(mtime.microsecond))
-        d = [
-            # 'name' is being extracted and stored by _build_tree, so
-            # there's a (tiny) net memory gain and a significant
-            # performance gain to just storing name directly. If
-            # _build_tree didn't need a copy of 'name', I believe
-            # there could be a significant memory gain from encoding
-            # 'name' in _data, too.
-
-            #self._encode(name.encode('utf-8', errors='surrogateescape')),
-            b'', # Placeholder for 'name'
-            str(parentid).encode('utf-8'),
-            self._encode(contentid),
-            str(size).encode('utf-8'),
-            mtimestr.encode('utf-8'),
-            str(mtime_nsec).encode('utf-8'),
-            filetype.encode('utf-8') ]
-        for k,v in extra_data.items():
-            d.append(
-                self._encode(k.encode('utf-8')) + b':' +
-                self._encode(str(v).encode('utf-8')))
-        self._data = b'&'.join(d)
-
-    def _decode(self, data):
-        return data.replace(b'%a', b'&').replace(b'%p', b'%')
-
-    def _encode(self, data):
-        return data.replace(
-            b'%p', b'%pp').replace(b'%a', b'%pa').replace(b'&', b'%a')
-
-    @property
-    def xname(self):
-        return self._decode(self._data.split(b'&', 1)[0]).decode(
-            'utf-8', errors='surrogateescape')
+        self._parentid = parentid
+        self._contentid = contentid
+        self._size = size
+        # The second of the year is always less than 2**25
+        self._mtime = (mtime_year << 25) | mtime_second
+        self._mtime_nsec = mtime_nsec
+        self._filetype = filetype
+        self._extra_data = extra_data
 
     @property
     def parentid(self):
-        return int(self._data.split(b'&', 2)[1])
+        return self._parentid
 
     @property
     def contentid(self):
-        return self._decode(self._data.split(b'&', 3)[2])
+        return self._contentid
 
     @property
     def size(self):
-        return int(self._data.split(b'&', 4)[3])
+        return self._size
 
     @property
     def mtime(self):
-        mtimeparts = [
-            int(x) for x in
-            self._data.split(b'&', 5)[4].decode('utf-8').split('.') ]
-        return datetime.datetime(*mtimeparts)
+        return (
+            datetime.datetime(self._mtime >> 25, 1, 1) +
+            datetime.timedelta(
+                seconds=self._mtime & 0x1ffffff,
+                microseconds=self._mtime_nsec // 1000))
 
     @property
     def mtime_nsec(self):
-        return int(self._data.split(b'&', 6)[5])
+        return self._mtime_nsec
 
     @property
     def filetype(self):
-        return self._data.split(b'&', 7)[6].decode('utf-8')
+        return self._filetype
 
     @property
     def extra_data(self):
-        items = self._data.split(b'&')[7:]
-        xd = {}
-        for item in items:
-            k, v = item.split(b':', 1)
-            # If an unknown key shows up here, it may need to be
-            # decoded to the proper type (similar to what is done with
-            # 'unix-access' already).
-            assert k in (b'owner', b'group', b'unix-access')
-            if k == b'unix-access':
-                value = int(v)
-            else:
-                value = v.decode('utf-8')
-            xd[k.decode('utf-8')] = value
-        return xd
+        return dict(self._extra_data)
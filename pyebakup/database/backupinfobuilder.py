@@ -34,9 +34,7 @@ class BackupInfoBuilder(object):
         The backup is registered as having been completed at 'when'
         (which should be a naive datetime.datetime in utc timezone).
         '''
-        endsetting = '{:04}-{:02}-{:02}T{:02}:{:02}:{:02}'.format(
-                when.year, when.month, when.day,
-                when.hour, when.minute, when.second).encode('utf-8')
+        endsetting = when.isoformat(timespec='seconds').encode('ascii')
         self._dbfile.insert_item(0, -1, datafile.ItemSetting(
             b'end', endsetting))
         self._dbfile.commit_and_close()
@@ -98,6 +96,8 @@ class BackupInfoBuilder(object):
             self._extra_xids[kvids] = xid
         return xid
 
+    _encoded_keys = {
+        'owner': b'owner', 'group': b'group', 'unix-access': b'unix-access' }
     def _encode_key_value(self, key, value):
         if key == 'owner':
             value = value.encode('utf-8')
@@ -107,12 +107,11 @@ class BackupInfoBuilder(object):
             v = value
             value = b''
             for i in range(4):
-                value = str(v % 8).encode('utf-8') + value
+                value = str(v % 8).encode('ascii') + value
                 v = v // 8
         else:
             raise NotImplementedError('Unknown key: ' + str(key))
-        key = key.encode('utf-8')
-        return key, value
+        return self._encoded_keys[key], value
 
     def _add_definition_to_dbfile(self, item):
         if self._defblock is None:
@@ -5,8 +5,16 @@ import datetime
 
 from . import datafile
 
+# 'first_seen_timestamp' is the raw timestamp stored in the file. It
+# is only turned into a datetime when someone actually asks for it,
+# since most content items are never looked at after the file is
+# loaded. 'first_seen_time' holds the datetime given to
+# add_content_item() for items added since the file was loaded, and
+# is None otherwise.
 ContentData = collections.namedtuple(
-    'ContentData', ('contentid', 'checksum', 'first_seen'))
+    'ContentData',
+    ('contentid', 'checksum', 'first_seen_timestamp', 'first_seen_time'),
+    defaults=(None,))
 
 class ContentInfoFile(object):
     def __init__(self, db):
@@ -43,9 +51,7 @@ class ContentInfoFile(object):
         if hasattr(item, 'last'):
             self._logger.warn('deprecated', 'item.last')
         self._contentdata[item.cid] = ContentData(
-            item.cid,
-            item.checksum,
-            datetime.datetime.utcfromtimestamp(item.first))
+            item.cid, item.checksum, item.first)
 
     def get_info_for_cid(self, cid):
         '''Return the ContentInfo object for 'cid'.
@@ -96,7 +102,7 @@ class ContentInfoFile(object):
         with self._dbfile:
             self._dbfile.append_item(item)
         self._contentdata[contentid] = ContentData(
-            contentid, checksum, when)
+            contentid, checksum, timestamp, when)
         return contentid
 
 
@@ -149,4 +155,7 @@ class ContentInfo(object):
 
     def get_first_seen_time(self):
         # IMPLEMENTME
-        return self._data.first_seen
+        if self._data.first_seen_time is not None:
+            return self._data.first_seen_time
+        return datetime.datetime.utcfromtimestamp(
+            self._data.first_seen_timestamp)
@@ -4,8 +4,7 @@ import hashlib
 import re
 
 from . import datafile
-
-from .dbfileopener import DBFileOpener
+from . import dbfileopener
 
 
 
@@ -31,12 +30,10 @@ class Database(object):
     def __init__(self, tree, path):
         self._tree = tree
         self._path = path
-        self._fileopener = None
+        self._dbfileopener = dbfileopener
         self._content = None
         self._content_checksum_name_value = None
 
-    _re_backup_file = re.compile(r'^\d\d-\d\dT\d\d:\d\d$')
-
     def get_all_backup_names(self, order_by=None):
         '''Obtain a list of the names of all backups.
 
@@ -118,11 +115,8 @@ class Database(object):
         years = []
         dirs, files = self._tree.get_directory_listing(self._path)
         for name in dirs:
-            try:
-                name_as_num = int(name)
-                years.append(name_as_num)
-            except ValueError:
-                pass
+            if len(name) == 4 and name.isascii() and name.isdigit():
+                years.append(int(name))
         years.sort()
         return years
 
@@ -159,8 +153,7 @@ class Database(object):
         to the starting time.
         '''
         yearly = self._get_backup_names_for_year(when.year)
-        when_name = '{:04}-{:02}-{:02}T{:02}:{:02}'.format(
-            when.year, when.month, when.day, when.hour, when.minute)
+        when_name = when.isoformat(timespec='minutes')
         candidates = [x for x in yearly if x <= when_name]
         while candidates:
             backup = self._dbfileopener.open_backup(self, candidates.pop())
@@ -177,8 +170,7 @@ class Database(object):
         starting time.
         '''
         yearly = self._get_backup_names_for_year(when.year)
-        when_name = '{:04}-{:02}-{:02}T{:02}:{:02}'.format(
-            when.year, when.month, when.day, when.hour, when.minute)
+        when_name = when.isoformat(timespec='minutes')
         candidates = [x for x in yearly if x >= when_name]
         candidates.reverse()
         while candidates:
@@ -258,14 +250,8 @@ class Database(object):
 
         This is primarily intended for testing.
         '''
-        assert self._fileopener is None
-        self._fileopener = opener
-
-    @property
-    def _dbfileopener(self):
-        if self._fileopener is None:
-            self._fileopener = DBFileOpener()
-        return self._fileopener
+        assert self._dbfileopener is dbfileopener
+        self._dbfileopener = opener
 
     @property
     def _content_checksum_name(self):
@@ -273,10 +259,16 @@ class Database(object):
             self._read_main()
         return self._content_checksum_name_value
 
+    # Content checksum algorithm name -> hashlib-style constructor
+    _checksum_algorithms = {
+        'sha256': hashlib.sha256,
+    }
+
     def _get_checksum_algorithm_from_name(self, name):
-        if name == 'sha256':
-            return hashlib.sha256
-        raise AssertionError('Unknown checksum algorithm: ' + str(name))
+        algorithm = self._checksum_algorithms.get(name)
+        if algorithm is None:
+            raise AssertionError('Unknown checksum algorithm: ' + str(name))
+        return algorithm
 
     def _load_content_file(self):
         if self._content is not None:
@@ -1,7 +1,17 @@
 #!/usr/bin/env python3
 
+import collections
 import hashlib
 import re
+import struct
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 from . import valuecodecs
 
@@ -14,13 +24,28 @@ class InvalidDataError(Exception): pass
 class InternalError(Exception): pass
 class ItemNotFoundError(Exception): pass
 
+def _blake2b_256(data=b''):
+    return hashlib.blake2b(data, digest_size=32)
+
+# Block checksum algorithm name -> (constructor, digest size,
+# collision resistant). flush() only trusts a matching checksum to
+# mean a block is unchanged when the checksum is collision resistant.
+_block_checksums = {
+    b'sha256': (hashlib.sha256, 32, True),
+    b'md5': (hashlib.md5, 16, True),
+    b'blake2b': (_blake2b_256, 32, True),
+}
+if blake3 is not None:
+    _block_checksums[b'blake3'] = (blake3.blake3, 32, True)
+if xxhash is not None:
+    _block_checksums[b'xxh3-128'] = (xxhash.xxh3_128, 16, False)
+
 def _get_checksum_by_name(name):
-    if name == b'sha256':
-        return hashlib.sha256
-    if name == b'md5':
-        return hashlib.md5
-    raise NotImplementedError(
-        'Unknown block checksum: ' + repr(name))
+    checksum = _block_checksums.get(name)
+    if checksum is None:
+        raise NotImplementedError(
+            'Unknown block checksum: ' + repr(name))
+    return checksum
 
 def create_main_in_replacement_mode(tree, dbpath):
     '''Create an ebakup database at tree:dbpath and return a writable
@@ -34,9 +59,7 @@ def create_main_in_replacement_mode(tree, dbpath):
     final = DataFile(tree, dbpath + ('main',))
     f.create_and_lock()
     f.set_replacement_mode_with_datafile(final)
-    f.append_item(ItemMagic(b'ebakup database v1'))
-    f.append_item(ItemSetting(b'edb-blocksize', b'4096'))
-    f.append_item(ItemSetting(b'edb-blocksum', b'sha256'))
+    f._set_default_block_0(b'ebakup database v1')
     return f
 
 def create_content_in_replacement_mode(tree, dbpath):
@@ -52,9 +75,7 @@ def create_content_in_replacement_mode(tree, dbpath):
     final = DataFile(tree, dbpath + ('content',))
     f.create_and_lock()
     f.set_replacement_mode_with_datafile(final)
-    f.append_item(ItemMagic(b'ebakup content data'))
-    f.append_item(ItemSetting(b'edb-blocksize', b'4096'))
-    f.append_item(ItemSetting(b'edb-blocksum', b'sha256'))
+    f._set_default_block_0(b'ebakup content data')
     return f
 
 def replace_content(tree, dbpath):
@@ -92,9 +113,7 @@ def create_backup_in_replacement_mode(tree, dbpath, starttime):
     new = DataFile(tree, newpath)
     new.create_and_lock()
     new.set_replacement_mode_with_datafile(old)
-    new.append_item(ItemMagic(b'ebakup backup data'))
-    new.append_item(ItemSetting(b'edb-blocksize', b'4096'))
-    new.append_item(ItemSetting(b'edb-blocksum', b'sha256'))
+    new._set_default_block_0(b'ebakup backup data')
     new.append_item(ItemSetting(
         b'start',
         '{:04}-{:02}-{:02}T{:02}:{:02}:{:02}'.format(
@@ -103,27 +122,35 @@ def create_backup_in_replacement_mode(tree, dbpath, starttime):
         .encode('utf-8')))
     return new
 
-def open_main(tree, dbpath, writable=False):
+def open_main(tree, dbpath, writable=False, verify_checksums=True):
     '''Open the "main" file in the ebakup database at tree:dbpath.
 
     If 'writable' is True, the file is opened and locked for both
     reading and writing. Otherwise, the file is only opened and locked
     for reading.
+
+    If 'verify_checksums' is False and the file is opened read-only,
+    the checksums of the data blocks are not checked as the blocks are
+    read. Block 0 is always checked.
     '''
     f = DataFile(tree, dbpath + ('main',))
     if writable:
         raise NotImplementedError()
     else:
-        f.open_and_lock_readonly()
+        f.open_and_lock_readonly(verify_checksums=verify_checksums)
     return f
 
-def open_content(tree, dbpath, writable=False):
+def open_content(tree, dbpath, writable=False, verify_checksums=True):
     '''Open the "content" file in the ebakup database at tree:dbpath.
 
     If 'writable' is True, the file is opened and locked for both
     reading and writing. Otherwise, the file is only opened and locked
     for reading.
 
+    If 'verify_checksums' is False and the file is opened read-only,
+    the checksums of the data blocks are not checked as the blocks are
+    read. Block 0 is always checked.
+
     Remember that if you want to hold more than one file from the same
     ebakup database open at the same time, you need to hold a lock on
     "main" as long as you have locked any of the other files.
@@ -132,11 +159,12 @@ def open_content(tree, dbpath, writable=False):
     if writable:
         f.open_and_lock_readwrite()
     else:
-        f.open_and_lock_readonly()
+        f.open_and_lock_readonly(verify_checksums=verify_checksums)
     return f
 
 _re_bk_name = re.compile(r'^(\d{4})-(\d\d-\d\dT\d\d:\d\d)$')
-def open_backup_by_name(tree, dbpath, name, writable=False):
+def open_backup_by_name(
+        tree, dbpath, name, writable=False, verify_checksums=True):
     '''Open the backup file for the backup with the name 'name' in the
     ebakup database at tree:dbpath.
 
@@ -144,6 +172,10 @@ def open_backup_by_name(tree, dbpath, name, writable=False):
     reading and writing. Otherwise, the file is only opened and locked
     for reading.
 
+    If 'verify_checksums' is False and the file is opened read-only,
+    the checksums of the data blocks are not checked as the blocks are
+    read. Block 0 is always checked.
+
     Remember that if you want to hold more than one file from the same
     ebakup database open at the same time, you need to hold a lock on
     "main" as long as you have locked any of the other files.
@@ -155,15 +187,11 @@ def open_backup_by_name(tree, dbpath, name, writable=False):
     if writable:
         raise AssertionError('backup files are immutable!')
     else:
-        f.open_and_lock_readonly()
-    for item in f:
-        if item.kind == 'setting' and item.key == b'start':
-            value = item.value
-            break
-        if item.kind not in ('setting', 'magic'):
-            raise InvalidDataError(
-                'Failed to find "start" setting in backup file')
-    f.seek(0, 0)
+        f.open_and_lock_readonly(verify_checksums=verify_checksums)
+    value = f._get_setting(b'start')
+    if value is None:
+        raise InvalidDataError(
+            'Failed to find "start" setting in backup file')
     if name != value[:-3].decode('utf-8'):
         raise InvalidDataError(
             'Backup file has non-matching start time: ' +
@@ -251,11 +279,17 @@ class DataFile(object):
         self._create_block_0()
         self._initialize_file_data()
 
-    def open_and_lock_readonly(self):
+    def open_and_lock_readonly(self, verify_checksums=True):
         '''Open and lock the file for reading.
+
+        If 'verify_checksums' is False, the checksums of the data
+        blocks will not be checked when they are read. This makes
+        reading faster, but corrupt data will not be detected. The
+        checksum of the first block is always checked.
         '''
         if self._file is not None:
             raise AssertionError('File already open')
+        self._verify_checksums = verify_checksums
         self._file = self._tree.get_item_at_path(self._path)
         self._file.lock_for_reading()
         self._check_correct_file_opened()
@@ -310,8 +344,8 @@ class DataFile(object):
             self.close()
             return
         self.flush()
-        if not self._tree.is_same_file_system_as(replace._tree):
-            raise AssertionError('Can not replace between file systems')
+        # set_replacement_mode_with_datafile() has already checked
+        # that both files are on the same file system.
         self._tree.rename_and_overwrite(self._path, replace._path)
         replace.close()
         f.close()
@@ -339,6 +373,9 @@ class DataFile(object):
             self._file.close()
         self._clear_file_data()
 
+    # Largest amount of data flush() writes in a single call.
+    _max_write_size = 128 * 1024
+
     def flush(self):
         '''Flush any unwritten data to the file.
 
@@ -348,11 +385,42 @@ class DataFile(object):
         '''
         if self._file is None:
             raise AssertionError('File is not open')
-        for idx, block in self._blocks.items():
-            assert block.blockno == idx
-            if block.modified:
-                block.modified = False
-                self._write_block(idx, block)
+        # Consecutive modified blocks are written with a single call
+        # (up to _max_write_size octets), since that is typically much
+        # cheaper than one write per block.
+        dirty = sorted(
+            idx for idx, block in self._blocks.items() if block.modified)
+        if not dirty:
+            return
+        maxrun = max(1, self._max_write_size // self._blocksize)
+        # The encoded parts of each block in the current run. They are
+        # joined only once per run, so the block data is copied just
+        # once on its way to the file.
+        run = []
+        runlen = 0
+        for idx in dirty:
+            if runlen and (idx != runstart + runlen or runlen >= maxrun):
+                self._write_block_data(runstart, b''.join(run))
+                run = []
+                runlen = 0
+            if not runlen:
+                runstart = idx
+            block = self._blocks[idx]
+            block.modified = False
+            parts = self._encode_block(idx, block)
+            ondisk = self._disk_key(parts)
+            if ondisk == block.disk_key:
+                # The file already holds exactly this data
+                if runlen:
+                    self._write_block_data(runstart, b''.join(run))
+                    run = []
+                    runlen = 0
+                continue
+            block.disk_key = ondisk
+            run.extend(parts)
+            runlen += 1
+        if runlen:
+            self._write_block_data(runstart, b''.join(run))
 
     def sync(self):
         '''Ensure all changes are written to the physical medium.
@@ -372,7 +440,8 @@ class DataFile(object):
         support this feature, so this method can't be completely
         trusted to do its job.
         '''
-        raise NotImplementedError()
+        self.flush()
+        self._file.sync_data()
 
     def __iter__(self):
         '''A DataFile is its own iterator.
@@ -389,17 +458,29 @@ class DataFile(object):
         '''
         if self._file is None:
             raise AssertionError('File is not open')
-        try:
-            block = self._load_block(self._pos[0])
-        except ItemNotFoundError:
-            raise StopIteration()
-        try:
-            item = block.get_item(self._pos[1])
-        except ItemNotFoundError:
-            self._pos = (self._pos[0] + 1, 0)
-            return self.__next__()
-        self._pos = (self._pos[0], self._pos[1] + 1)
-        return item
+        blockidx, itemidx = self._pos
+        while True:
+            try:
+                block = self._load_block(blockidx)
+            except ItemNotFoundError:
+                self._pos = (blockidx, 0)
+                raise StopIteration()
+            try:
+                item = block.get_item(itemidx)
+            except ItemNotFoundError:
+                # Move on to the next block (which may also be empty)
+                blockidx += 1
+                itemidx = 0
+                continue
+            self._pos = (blockidx, itemidx + 1)
+            return item
+
+    def _get_setting(self, key):
+        '''Return the value of the setting 'key' in block 0, or None if
+        there is no such setting. Does not change the current read
+        position.
+        '''
+        return self._load_block(0).get_setting(key)
 
     def get_last_block_index(self):
         '''Return the index of the last block that exists in the file.
@@ -481,27 +562,30 @@ class DataFile(object):
         if self._file is None:
             raise AssertionError('File is not open')
         if item.kind in ('magic', 'setting'):
-            if self._last_block_index != 0:
-                raise AssertionError('Settings block is not last')
-            if item.kind == 'magic':
-                self._handle_magic(item.value)
-            elif item.kind == 'setting':
-                self._handle_setting(item.key, item.value)
-            block = self._load_block(0)
-            block.append_item(item)
+            self._append_block_0_item(item)
             return
+        # Full blocks are left in the block cache rather than written
+        # straight away, so that flush() can write them together.
         if self._last_block_index == 0:
-            self._flush_block(0)
-            self._create_block()
-        last_block = self._load_block(self._last_block_index)
-        if last_block.try_append(item):
-            return
-        self._flush_block(self._last_block_index)
-        block = self._create_block()
+            block = self._create_block()
+        else:
+            block = self._load_block(self._last_block_index)
+            if block.try_append(item):
+                return
+            block = self._create_block()
         if not block.try_append(item):
             self._drop_block(self._last_block_index)
             raise AssertionError('Item too large for a single block')
 
+    def _append_block_0_item(self, item):
+        if self._last_block_index != 0:
+            raise AssertionError('Settings block is not last')
+        if item.kind == 'magic':
+            self._handle_magic(item.value)
+        else:
+            self._handle_setting(item.key, item.value)
+        self._load_block(0).append_item(item)
+
     def remove_item(self, block, index):
         '''Remove the 'index'th item in the 'block'th block from the file.
 
@@ -598,11 +682,22 @@ class DataFile(object):
         self._pos = None
         self._blocksize = None
         self._blockdatasize = None
+        self._zero_padding = None
         self._blocksum = None
+        self._digestsize = None
+        self._blocksum_collision_resistant = None
         self._itemcodec = None
         self._last_block_index = None
-        self._blocks = {}
+        self._blocks = collections.OrderedDict()
+        # (first block index, data). Starting out empty at block 1 makes
+        # the first data block count as a sequential read.
+        self._readahead = (1, b'')
         self._replace_file = None
+        self._verify_checksums = True
+        # Blocks whose data in the file is known to be good, either
+        # because its checksum was checked or because it was written by
+        # this DataFile.
+        self._verified_blocks = set()
 
     def _initialize_file_data(self):
         self._pos = (0, 0)
@@ -622,9 +717,40 @@ class DataFile(object):
         block = self._blocks.get(0)
         if block is not None:
             return
-        data = self._file.get_data_slice(0, 10000)
+        # The first read is sized for the default block size, which
+        # also covers the settings of any reasonable file.
+        data = self._file.get_data_slice(0, 4096)
         if data == b'':
             return
+        match = self._re_block_settings.match(data)
+        if match is not None:
+            magic, blocksize, blocksum = match.groups()
+            blocksize = int(blocksize, 10)
+        else:
+            data = self._file.get_data_slice(0, 10000)
+            magic, blocksize, blocksum = self._find_block_settings(data)
+        if len(data) < blocksize:
+            data = self._file.get_data_slice(0, blocksize)
+        self._blocksize = blocksize
+        (self._blocksum, self._digestsize,
+         self._blocksum_collision_resistant) = _get_checksum_by_name(blocksum)
+        self._set_blockdatasize()
+        blockdata = memoryview(data)[:self._blocksize]
+        self._check_blocksum(blockdata)
+        self._verified_blocks.add(0)
+        self._handle_magic(magic)
+        # Keep block 0, so it is not read and checked a second time.
+        self._add_loaded_block(
+            0, Block0(data[:self._blocksize], self._blockdatasize), blockdata)
+
+    # All files written by this module start with the magic followed
+    # directly by these two settings, so a single anchored match
+    # usually finds everything. Anything else falls back to searching
+    # for each setting separately.
+    _re_block_settings = re.compile(
+        rb'([^\n]*)\nedb-blocksize:(\d+)\nedb-blocksum:([^\n]*)\n')
+
+    def _find_block_settings(self, data):
         end = data.find(b'\n')
         if end < 0:
             raise AssertionError('No magic found')
@@ -647,11 +773,7 @@ class DataFile(object):
         if end < 0:
             raise AssertionError('No end of block checksum algorithm')
         blocksum = data[start+14:end]
-        self._blocksize = blocksize
-        self._blocksum = _get_checksum_by_name(blocksum)
-        self._blockdatasize = blocksize - self._blocksum().digest_size
-        self._check_blocksum(data[:self._blocksize])
-        self._handle_magic(magic)
+        return magic, blocksize, blocksum
 
     def _create_block_0(self):
         assert 0 not in self._blocks
@@ -660,6 +782,31 @@ class DataFile(object):
         self._blocks[0] = block
         block.modified = True
         block.blockno = 0
+        block.disk_key = None
+
+    # The settings every file created by this module starts with.
+    _default_block_settings = (
+        b'edb-blocksize:4096\n'
+        b'edb-blocksum:sha256\n')
+
+    def _set_default_block_0(self, magic):
+        '''Give a newly created file the magic 'magic' and the default
+        block settings. This is the same as appending the corresponding
+        items one by one, but without the overhead of doing so.
+        '''
+        assert self._last_block_index == 0
+        assert not self._blocks[0].encode()
+        assert b'\n' not in magic
+        self._handle_magic(magic)
+        self._handle_setting(b'edb-blocksize', b'4096')
+        self._handle_setting(b'edb-blocksum', b'sha256')
+        block = Block0(
+            magic + b'\n' + self._default_block_settings,
+            self._blockdatasize)
+        self._blocks[0] = block
+        block.modified = True
+        block.blockno = 0
+        block.disk_key = None
 
     def _create_block(self):
         assert self._last_block_index >= 0
@@ -669,39 +816,39 @@ class DataFile(object):
         self._blocks[self._last_block_index] = block
         block.modified = True
         block.blockno = self._last_block_index
+        block.disk_key = None
         return block
 
     def _check_correct_file_opened(self):
         if not self._tree.is_open_file_same_as_path(self._file, self._path):
             raise AssertionError('The opened file is not at the expected path')
 
-    def _flush_block(self, idx):
-        block = self._blocks.get(idx)
-        if block is None:
-            return
-        if block.modified:
-            block.modified = False
-            self._write_block(idx, block)
-
-    def _write_block(self, idx, block):
+    def _write_block_data(self, idx, data):
+        # 'data' is one or more complete blocks, starting at block 'idx'
+        assert len(data) % self._blocksize == 0
+        self._readahead = (0, b'')
+        self._file.write_data_slice(idx * self._blocksize, data)
+        self._verified_blocks.update(
+            range(idx, idx + len(data) // self._blocksize))
+
+    def _encode_block(self, idx, block):
+        # Returns the data, padding and checksum of the block, which
+        # together make up its on-disk form.
         assert block.blockno == idx
         data = block.encode()
         if len(data) > self._blockdatasize:
             raise AssertionError('Final block data too big!')
-        data += b'\x00' * (self._blockdatasize - len(data))
-        assert len(data) == self._blockdatasize
-        cksum = self._blocksum(data).digest()
-        self._file.write_data_slice(idx * self._blocksize, data + cksum)
+        # Slicing the memoryview does not copy the padding.
+        padding = self._zero_padding[:self._blockdatasize - len(data)]
+        cksum = self._blocksum(data)
+        cksum.update(padding)
+        return data, padding, cksum.digest()
 
     def _handle_magic(self, value):
-        if value == b'ebakup database v1':
-            self._itemcodec = MainHandler()
-        elif value == b'ebakup content data':
-            self._itemcodec = ContentHandler()
-        elif value == b'ebakup backup data':
-            self._itemcodec = BackupHandler()
-        else:
+        itemcodec = _magic_handlers.get(value)
+        if itemcodec is None:
             raise NotImplementedError('Unhandled magic')
+        self._itemcodec = itemcodec
 
     def _handle_setting(self, key, value):
         if key == b'edb-blocksize':
@@ -711,41 +858,101 @@ class DataFile(object):
         if key == b'edb-blocksum':
             if self._blocksum is not None:
                 raise AssertionError('Block checksum algorithm set twice')
-            self._blocksum = _get_checksum_by_name(value)
+            (self._blocksum, self._digestsize,
+             self._blocksum_collision_resistant) = _get_checksum_by_name(value)
         if self._blocksum is not None and self._blocksize is not None:
             if self._blockdatasize is None:
-                self._blockdatasize = (
-                    self._blocksize - self._blocksum().digest_size)
+                self._set_blockdatasize()
+
+    def _set_blockdatasize(self):
+        # Called once both the block size and the block checksum
+        # algorithm are known.
+        self._blockdatasize = self._blocksize - self._digestsize
+        self._zero_padding = memoryview(bytes(self._blockdatasize))
 
     def _load_block(self, index):
         block = self._blocks.get(index)
         if block is not None:
+            self._blocks.move_to_end(index)
             return block
         self._limit_block_cache()
-        blockdata = self._file.get_data_slice(
-            index * self._blocksize, (index+1) * self._blocksize)
+        blockdata = self._read_block_data(index)
         if blockdata == b'':
             raise ItemNotFoundError('Requested block beyond end of file')
         assert len(blockdata) == self._blocksize
-        self._check_blocksum(blockdata)
+        if index not in self._verified_blocks and (
+                self._verify_checksums or index == 0):
+            self._check_blocksum(blockdata)
+            self._verified_blocks.add(index)
         if index == 0:
             block = Block0(blockdata, self._blockdatasize)
         else:
             block = self._itemcodec.decode_block(
                 blockdata, self._blockdatasize)
             block.set_blockdatasize(self._blockdatasize)
+        self._add_loaded_block(index, block, blockdata)
+        return block
+
+    def _add_loaded_block(self, index, block, blockdata):
         self._blocks[index] = block
         block.blockno = index
-        return block
+        # Identifies the data in the file, so unchanged blocks need
+        # not be written back.
+        if self._blocksum_collision_resistant:
+            block.disk_key = bytes(blockdata[self._blockdatasize:])
+        else:
+            block.disk_key = bytes(blockdata)
+
+    def _disk_key(self, parts):
+        # 'parts' is the encoded block, as returned by _encode_block().
+        # A collision of a weak checksum must never make flush() skip
+        # a changed block, so then the whole block is compared.
+        if self._blocksum_collision_resistant:
+            return parts[-1]
+        return b''.join(parts)
+
+    # Number of blocks to read from the file at a time when reading
+    # sequentially. Reading many blocks in one go is much cheaper than
+    # reading them one by one.
+    _readahead_blocks = 32
+
+    def _read_block_data(self, index):
+        start, data = self._readahead
+        offset = (index - start) * self._blocksize
+        if 0 <= offset < len(data):
+            return data[offset:offset + self._blocksize]
+        if index > self._last_block_index:
+            return b''
+        # Only read ahead when this block directly follows the
+        # previously read data. Random access reads a single block.
+        count = self._readahead_blocks if offset == len(data) else 1
+        data = self._file.get_data_slice(
+            index * self._blocksize, (index + count) * self._blocksize)
+        self._readahead = (index, data)
+        return data[:self._blocksize]
+
+    # Maximum number of decoded blocks to keep in memory. The least
+    # recently used unmodified block is dropped to make room for a new
+    # one. Block 0 holds the settings and is always kept.
+    _block_cache_size = 64
 
     def _limit_block_cache(self):
-        if len(self._blocks) < 10:
+        blocks = self._blocks
+        if len(blocks) < self._block_cache_size:
             return
+        for idx, block in blocks.items():
+            if idx != 0 and not block.modified:
+                del blocks[idx]
+                return
         self.flush()
-        self._blocks = {}
+        for idx in blocks:
+            if idx != 0:
+                del blocks[idx]
+                return
 
     def _check_blocksum(self, data):
         assert len(data) == self._blocksize
+        data = memoryview(data)
         if (self._blocksum(data[:self._blockdatasize]).digest() !=
                 data[self._blockdatasize:]):
             raise InvalidDataError('Block checksum mismatch')
@@ -755,51 +962,77 @@ class Block0(object):
         self.modified = False
         if blockdatasize is not None and len(data) > blockdatasize:
             data = data[:blockdatasize]
-        if data:
-            data = data.split(b'\n')
-            if data[-1].endswith(b'\x00'):
-                if data[-1].strip(b'\x00') != b'':
-                    raise InvalidDataError('trailing garbage')
-                data = data[:-1]
-            if data and data[-1] == b'':
+        if data.endswith(b'\x00'):
+            end = data.rfind(b'\n') + 1
+            if data.count(b'\x00', end) != len(data) - end:
+                raise InvalidDataError('trailing garbage')
+            data = data[:end]
+            if data.endswith(b'\n\n') or data == b'\n':
                 data = data[:-1]
-            self._data = [ x + b'\n' for x in data ]
-        else:
-            self._data = []
-        self._datasize = len(data)
+        elif data and not data.endswith(b'\n'):
+            data += b'\n'
+        self._encoded = bytearray(data)
+        self._encode_cache = None
+        # Start offset of each line, plus the end of the data. Only
+        # built when an item is actually looked up.
+        self._offsets = None
         self._blockdatasize = blockdatasize
 
     def encode(self):
-        return b''.join(self._data)
+        if self._encode_cache is None:
+            self._encode_cache = bytes(self._encoded)
+        return self._encode_cache
 
     def set_blockdatasize(self, size):
         assert self._blockdatasize is None
-        if self._datasize > size:
+        if len(self._encoded) > size:
             raise BlockFullError('Block 0 is over the new limit')
         self._blockdatasize = size
 
+    def _get_offsets(self):
+        offsets = self._offsets
+        if offsets is None:
+            encoded = self._encoded
+            offsets = [0]
+            end = encoded.find(b'\n')
+            while end >= 0:
+                offsets.append(end + 1)
+                end = encoded.find(b'\n', end + 1)
+            self._offsets = offsets
+        return offsets
+
     def get_item(self, index):
         assert index >= 0
-        if index >= len(self._data):
+        offsets = self._get_offsets()
+        if index >= len(offsets) - 1:
             raise ItemNotFoundError('Item ' + str(index) + ' not found')
-        data = self._data[index]
+        data = bytes(self._encoded[offsets[index]:offsets[index+1] - 1])
         if index == 0:
-            return ItemMagic(data[:-1])
-        colon = data.find(b':')
-        if colon < 0:
+            return ItemMagic(data)
+        key, colon, value = data.partition(b':')
+        if not colon:
             raise AssertionError('Invalid item data: ' + str(data))
-        return ItemSetting(data[:colon], data[colon+1:-1])
+        return ItemSetting(key, value)
+
+    def get_setting(self, key):
+        encoded = self._encoded
+        needle = b'\n' + key + b':'
+        start = encoded.find(needle)
+        if start < 0:
+            return None
+        start += len(needle)
+        return bytes(encoded[start:encoded.find(b'\n', start)])
 
     def append_item(self, item):
         if item.kind == 'magic':
-            if self._data:
+            if self._encoded:
                 raise AssertionError('"Magic" item must be the first one')
             assert isinstance(item.value, bytes)
             data = item.value + b'\n'
         elif item.kind == 'setting':
             assert isinstance(item.key, bytes)
             assert isinstance(item.value, bytes)
-            if not self._data:
+            if not self._encoded:
                 raise AssertionError('First item must be "magic"')
             assert b'\n' not in item.key
             assert b':' not in item.key
@@ -809,11 +1042,13 @@ class Block0(object):
             raise AssertionError(
                 'Unknown item type for block 0: ' + str(item.kind))
         if (self._blockdatasize is not None and
-                len(data) + self._datasize > self._blockdatasize):
+                len(data) + len(self._encoded) > self._blockdatasize):
             raise BlockFullError('Block 0 full')
         self.modified = True
-        self._data.append(data)
-        self._datasize += len(data)
+        self._encoded += data
+        self._encode_cache = None
+        if self._offsets is not None:
+            self._offsets.append(len(self._encoded))
 
 
 class MainHandler(object):
@@ -822,13 +1057,15 @@ class MainHandler(object):
 class ContentBlock(object):
     def __init__(self):
         self.modified = False
-        self._items = [] # [ (data, item) ]
-        self._datasize = 0
+        # The items, and all of their encoded data in the same order
+        self._items = []
+        self._data = bytearray()
+        self._encode_cache = None
         self._blockdatasize = None
 
     def set_blockdatasize(self, size):
         assert self._blockdatasize is None
-        if self._datasize > size:
+        if len(self._data) > size:
             raise BlockFullError('Block is over the new size limit')
         self._blockdatasize = size
 
@@ -836,12 +1073,14 @@ class ContentBlock(object):
         assert index >= 0
         if index >= len(self._items):
             raise ItemNotFoundError('Item ' + str(index) + ' not found')
-        return self._items[index][1]
+        return self._items[index]
 
     def append_item(self, item):
         if not self.try_append(item):
             raise BlockFullError('Block is full')
 
+    _pack_first_and_last = struct.Struct('<II').pack
+
     def try_append(self, item):
         if item.kind == 'content':
             data = [ b'\xdd' ]
@@ -853,49 +1092,57 @@ class ContentBlock(object):
                 if not item.checksum.startswith(item.cid):
                     raise InvalidDataError('cid and checksum mismatch')
                 data.append(item.checksum)
-            data.append(valuecodecs.make_uint32(item.first))
             if hasattr(item, 'last'):
                 self._logger.warn('deprecated', 'item.last')
             # The "last" data item in the file is obsoleted, so just
             # fill it with the first seen time instead.
-            data.append(valuecodecs.make_uint32(item.first))
+            if item.first < 0:
+                raise ValueError('Can not make uint32 from negative number')
+            if item.first > 0xffffffff:
+                raise ValueError(
+                    'Value too big for uint32: ' + str(item.first))
+            data.append(self._pack_first_and_last(item.first, item.first))
             if hasattr(item, 'updates'):
                 self._logger.warn('deprecated', 'item.updates')
             data = b''.join(data)
             if (self._blockdatasize is not None and
-                    self._datasize + len(data) > self._blockdatasize):
+                    len(self._data) + len(data) > self._blockdatasize):
                 return False
             self.modified = True
-            self._items.append((data, item))
-            self._datasize += len(data)
+            self._items.append(item)
+            self._data += data
+            self._encode_cache = None
             return True
         raise InvalidDataError('Unknown item type: ' + item.kind)
 
     def encode(self):
-        return b''.join(x[0] for x in self._items)
+        if self._encode_cache is None:
+            self._encode_cache = bytes(self._data)
+        return self._encode_cache
 
 class ContentHandler(object):
+    _unpack_first_and_last = struct.Struct('<II').unpack_from
+
     def decode_block(self, data, size):
         if size > len(data):
             size = len(data)
         done = 0
+        end = 0 # end of the last item
         block = ContentBlock()
         while done < size:
-            start = done
             if data[done] == 0xdd:
                 cidlen, done = valuecodecs.parse_varuint(data, done+1)
                 sumlen, done = valuecodecs.parse_varuint(data, done)
                 cid = data[done:done+cidlen]
-                cksum = data[done:done+sumlen]
+                # cid and checksum start at the same octet and are usually
+                # the same length, in which case they can share one object.
+                if sumlen == cidlen:
+                    cksum = cid
+                else:
+                    cksum = data[done:done+sumlen]
                 done += max(cidlen, sumlen)
-                first = (
-                    data[done] + data[done+1] * 0x100 +
-                    data[done+2] * 0x10000 + data[done+3] * 0x1000000)
-                done += 4
-                last = (
-                    data[done] + data[done+1] * 0x100 +
-                    data[done+2] * 0x10000 + data[done+3] * 0x1000000)
-                done += 4
+                first, last = self._unpack_first_and_last(data, done)
+                done += 8
                 if last != first:
                     self._logger.warn('deprecated', 'item.last')
                 item = ItemContent(cid, cksum, first)
@@ -909,25 +1156,20 @@ class ContentHandler(object):
                     if data[done-1] == 0xa1:
                         checksum = data[done:done+sumlen]
                         done += sumlen
-                    first = (
-                        data[done] + data[done+1] * 0x100 +
-                        data[done+2] * 0x10000 + data[done+3] * 0x1000000)
-                    done += 4
-                    last = (
-                        data[done] + data[done+1] * 0x100 +
-                        data[done+2] * 0x10000 + data[done+3] * 0x1000000)
-                    done += 4
+                    first, last = self._unpack_first_and_last(data, done)
+                    done += 8
                 if done > size:
                     raise InvalidDataError(
                         'Content item overran block end at ' + str(done))
-                block._items.append((data[start:done], item))
-                block._datasize += done - start
+                block._items.append(item)
+                end = done
             elif data[done] == 0:
-                if data[done:size].strip(b'\x00'):
+                if data.count(0, done, size) != size - done:
                     raise InvalidDataError('Trailing garbage')
                 done = size
             else:
                 raise InvalidDataError('Unknown data item: ' + str(data[done]))
+        block._data = bytearray(data[:end])
         return block
 
     def create_empty_block(self, blockdatasize):
@@ -938,13 +1180,15 @@ class ContentHandler(object):
 class BackupBlock(object):
     def __init__(self):
         self.modified = False
-        self._items = [] # [ (data, item) ]
-        self._datasize = 0
+        # The items, and all of their encoded data in the same order
+        self._items = []
+        self._data = bytearray()
+        self._encode_cache = None
         self._blockdatasize = None
 
     def set_blockdatasize(self, size):
         assert self._blockdatasize is None
-        if self._datasize > size:
+        if len(self._data) > size:
             raise BlockFullError('Block is over the new size limit')
         self._blockdatasize = size
 
@@ -952,19 +1196,21 @@ class BackupBlock(object):
         assert index >= 0
         if index >= len(self._items):
             raise ItemNotFoundError('Item ' + str(index) + ' not found')
-        return self._items[index][1]
+        return self._items[index]
 
     def append_block_data(self, sourceblock):
-        if self._datasize + sourceblock._datasize > self._blockdatasize:
+        if len(self._data) + len(sourceblock._data) > self._blockdatasize:
             raise BlockFullError('Not sufficient space in the block')
         self._items += sourceblock._items
-        self._datasize += sourceblock._datasize
-        self._modified = True
+        self._data += sourceblock._data
+        self._encode_cache = None
+        self.modified = True
 
     def clear_block_data(self):
         self._items = []
-        self._datasize = 0
-        self._modified = True
+        self._data = bytearray()
+        self._encode_cache = None
+        self.modified = True
 
     def append_item(self, item):
         if not self.try_append(item):
@@ -973,192 +1219,234 @@ class BackupBlock(object):
     _filetypechars = {
         'file-unknown': b'?', 'file-symlink': b'L', 'file-socket': b'S',
         'file-pipe': b'P', 'file-device': b'D' }
-    def try_append(self, item):
-        if item.kind == 'directory':
-            if item.extra_data:
-                data = [ b'\x92' ]
-            else:
-                data = [ b'\x90' ]
-            data.append(valuecodecs.make_varuint(item.dirid))
-            data.append(valuecodecs.make_varuint(item.parent))
-            data.append(valuecodecs.make_varuint(len(item.name)))
-            data.append(item.name)
+
+    def _encode_directory(self, item):
+        if item.extra_data:
+            data = [ b'\x92' ]
+        else:
+            data = [ b'\x90' ]
+        data.append(valuecodecs.make_varuint(item.dirid))
+        data.append(valuecodecs.make_varuint(item.parent))
+        data.append(valuecodecs.make_varuint(len(item.name)))
+        data.append(item.name)
+        if item.extra_data:
+            data.append(valuecodecs.make_varuint(item.extra_data))
+        return b''.join(data)
+
+    _pack_mtime = struct.Struct('<HHBI').pack
+
+    def _encode_file(self, item):
+        if item.kind == 'file':
             if item.extra_data:
-                data.append(valuecodecs.make_varuint(item.extra_data))
-            data = b''.join(data)
-        elif item.kind.startswith('file'):
-            if item.kind == 'file':
-                if item.extra_data:
-                    data = [ b'\x93' ]
-                else:
-                    data = [ b'\x91' ]
+                data = [ b'\x93' ]
             else:
-                data = [ b'\x94' ]
-            data.append(valuecodecs.make_varuint(item.parent))
-            data.append(valuecodecs.make_varuint(len(item.name)))
-            data.append(item.name)
-            data.append(valuecodecs.make_varuint(len(item.cid)))
-            data.append(item.cid)
-            data.append(valuecodecs.make_varuint(item.size))
-            year = item.mtime_year
-            second = item.mtime_second
-            ns = item.mtime_ns
-            if year < 1000 or year > 9999:
-                raise InvalidDataError(
-                    'Unreasonable last-modified year: ' + str(year))
-            if second < 0 or second > 31622399:
-                # Not checking for December 32 in non-leap years
-                raise InvalidDataError(
-                    'Unreasonable last-modifed second of year: ' + str(second))
-            if ns < 0 or ns > 999999999:
-                raise InvalidDataError(
-                    'Unreasonable last-modified nanosecond: ' + str(ns))
-            mtime = bytes((
-                item.mtime_year & 0xff, (item.mtime_year >> 8),
-                item.mtime_second & 0xff, (item.mtime_second >> 8) & 0xff,
-                (item.mtime_second >> 16) & 0xff,
-                ((item.mtime_second >> 17) & 0x80) + (item.mtime_ns & 0x3f),
-                (item.mtime_ns >> 6) & 0xff, (item.mtime_ns >> 14) & 0xff,
-                item.mtime_ns >> 22))
-            data.append(mtime)
-            if item.kind != 'file':
-                filetypechar = self._filetypechars.get(item.kind)
-                if filetypechar is None:
-                    raise AssertionError('Unknown file type: ' + item.kind)
-                data.append(filetypechar)
-            if item.kind != 'file' or item.extra_data:
-                data.append(valuecodecs.make_varuint(item.extra_data))
-            data = b''.join(data)
-        elif item.kind == 'key-value':
-            assert b':' not in item.key
-            data = [ ]
-            data.append(valuecodecs.make_varuint(item.kvid))
-            data.append(item.key)
-            data.append(b':')
-            data.append(item.value)
-            data = b''.join(data)
-            data = b'\x21' + valuecodecs.make_varuint(len(data)) + data
-        elif item.kind == 'extradef':
-            data = [ ]
-            data.append(valuecodecs.make_varuint(item.xid))
-            for kvid in item.kvids:
-                data.append(valuecodecs.make_varuint(kvid))
-            data = b''.join(data)
-            data = b'\x22' + valuecodecs.make_varuint(len(data)) + data
+                data = [ b'\x91' ]
         else:
-            raise InvalidDataError('Unknown item type: ' + item.kind)
+            data = [ b'\x94' ]
+        data.append(valuecodecs.make_varuint(item.parent))
+        data.append(valuecodecs.make_varuint(len(item.name)))
+        data.append(item.name)
+        data.append(valuecodecs.make_varuint(len(item.cid)))
+        data.append(item.cid)
+        data.append(valuecodecs.make_varuint(item.size))
+        year = item.mtime_year
+        second = item.mtime_second
+        ns = item.mtime_ns
+        if year < 1000 or year > 9999:
+            raise InvalidDataError(
+                'Unreasonable last-modified year: ' + str(year))
+        if second < 0 or second > 31622399:
+            # Not checking for December 32 in non-leap years
+            raise InvalidDataError(
+                'Unreasonable last-modifed second of year: ' + str(second))
+        if ns < 0 or ns > 999999999:
+            raise InvalidDataError(
+                'Unreasonable last-modified nanosecond: ' + str(ns))
+        # The top bit of the second goes in the otherwise unused top
+        # bit of the nanosecond's lowest byte.
+        data.append(self._pack_mtime(
+            year, second & 0xffff, (second >> 16) & 0xff,
+            ((second >> 17) & 0x80) | (ns & 0x3f) | ((ns >> 6) << 8)))
+        if item.kind != 'file':
+            filetypechar = self._filetypechars.get(item.kind)
+            if filetypechar is None:
+                raise AssertionError('Unknown file type: ' + item.kind)
+            data.append(filetypechar)
+        if item.kind != 'file' or item.extra_data:
+            data.append(valuecodecs.make_varuint(item.extra_data))
+        return b''.join(data)
+
+    def _encode_key_value(self, item):
+        assert b':' not in item.key
+        data = [ ]
+        data.append(valuecodecs.make_varuint(item.kvid))
+        data.append(item.key)
+        data.append(b':')
+        data.append(item.value)
+        data = b''.join(data)
+        return b'\x21' + valuecodecs.make_varuint(len(data)) + data
+
+    def _encode_extradef(self, item):
+        data = [ ]
+        data.append(valuecodecs.make_varuint(item.xid))
+        for kvid in item.kvids:
+            data.append(valuecodecs.make_varuint(kvid))
+        data = b''.join(data)
+        return b'\x22' + valuecodecs.make_varuint(len(data)) + data
+
+    # item.kind -> encoder method
+    _encoders = {
+        'directory': _encode_directory,
+        'file': _encode_file,
+        'file-unknown': _encode_file,
+        'file-symlink': _encode_file,
+        'file-socket': _encode_file,
+        'file-pipe': _encode_file,
+        'file-device': _encode_file,
+        'key-value': _encode_key_value,
+        'extradef': _encode_extradef,
+    }
 
+    def try_append(self, item):
+        encoder = self._encoders.get(item.kind)
+        if encoder is None:
+            raise InvalidDataError('Unknown item type: ' + item.kind)
+        data = encoder(self, item)
         if (self._blockdatasize is not None and
-                self._datasize + len(data) > self._blockdatasize):
+                len(self._data) + len(data) > self._blockdatasize):
             return False
         self.modified = True
-        self._items.append((data, item))
-        self._datasize += len(data)
+        self._items.append(item)
+        self._data += data
+        self._encode_cache = None
         return True
 
     def encode(self):
-        return b''.join(x[0] for x in self._items)
+        if self._encode_cache is None:
+            self._encode_cache = bytes(self._data)
+        return self._encode_cache
 
 class BackupHandler(object):
     _filetypechars = {
         b'?'[0]: 'unknown', b'L'[0]: 'symlink', b'S'[0]: 'socket',
         b'P'[0]: 'pipe', b'D'[0]: 'device',
         }
+    _unpack_mtime = struct.Struct('<HHBI').unpack_from
+
+    def _decode_directory(self, data, done):
+        itemtype = data[done]
+        done += 1
+        dirid, done = valuecodecs.parse_varuint(data, done)
+        parent, done = valuecodecs.parse_varuint(data, done)
+        namelen, done = valuecodecs.parse_varuint(data, done)
+        name = data[done:done+namelen]
+        done += namelen
+        item = ItemDirectory(dirid, parent, name)
+        if itemtype == 0x92:
+            extra_data, done = valuecodecs.parse_varuint(data, done)
+            item.set_extra_data(extra_data)
+        return item, done
+
+    def _decode_file(self, data, done):
+        itemtype = data[done]
+        # parent, name length and cid length nearly always fit in one
+        # octet each, so check for that before parsing full varuints.
+        parent = data[done+1]
+        namelen = data[done+2]
+        if parent < 0x80 and namelen < 0x80:
+            done += 3
+        else:
+            parent, done = valuecodecs.parse_varuint(data, done + 1)
+            namelen, done = valuecodecs.parse_varuint(data, done)
+        name = data[done:done+namelen]
+        done += namelen
+        cidlen = data[done]
+        if cidlen < 0x80:
+            done += 1
+        else:
+            cidlen, done = valuecodecs.parse_varuint(data, done)
+        cid = data[done:done+cidlen]
+        done += cidlen
+        filesize, done = valuecodecs.parse_varuint(data, done)
+        mtime_year, second_low, second_high, packed = self._unpack_mtime(
+            data, done)
+        # The top bit of the second is packed into the low byte of the
+        # nanoseconds.
+        mtime_second = (
+            second_low | (second_high << 16) | ((packed & 0x80) << 17))
+        mtime_ns = (packed & 0x3f) | ((packed >> 8) << 6)
+        done += 9
+        if itemtype == 0x94:
+            ftype = self._filetypechars.get(data[done])
+            if ftype is None:
+                raise AssertionError(
+                    'Unknown filetype: ' + str(data[done]))
+            done += 1
+            item = ItemSpecialFile(
+                ftype, parent, name, cid, filesize,
+                (mtime_year, mtime_second, mtime_ns))
+        else:
+            item = ItemFile(
+                parent, name, cid, filesize,
+                (mtime_year, mtime_second, mtime_ns))
+        if itemtype != 0x91:
+            extra, done = valuecodecs.parse_varuint(data, done)
+            item.set_extra_data(extra)
+        return item, done
+
+    def _decode_key_value(self, data, done):
+        length, done = valuecodecs.parse_varuint(data, done + 1)
+        end = done + length
+        kvid, done = valuecodecs.parse_varuint(data, done)
+        key, value = data[done:end].split(b':', 1)
+        return ItemKeyValue(kvid, key, value), end
+
+    def _decode_extradef(self, data, done):
+        length, done = valuecodecs.parse_varuint(data, done + 1)
+        end = done + length
+        xid, done = valuecodecs.parse_varuint(data, done)
+        kvids = []
+        while done < end:
+            kvid, done = valuecodecs.parse_varuint(data, done)
+            kvids.append(kvid)
+        assert done == end
+        return ItemExtraDef(xid, tuple(kvids)), done
+
+    # First octet of an item -> decoder method
+    _decoders = [None] * 256
+    _decoders[0x90] = _decoders[0x92] = _decode_directory
+    _decoders[0x91] = _decoders[0x93] = _decoders[0x94] = _decode_file
+    _decoders[0x21] = _decode_key_value
+    _decoders[0x22] = _decode_extradef
+
     def decode_block(self, data, size):
         if size > len(data):
             size = len(data)
         done = 0
         block = BackupBlock()
+        items = block._items
+        decoders = self._decoders
         while done < size:
-            item = None
-            start = done
-            if data[done] in (0x90, 0x92):
-                itemtype = data[done]
-                done += 1
-                dirid, done = valuecodecs.parse_varuint(data, done)
-                parent, done = valuecodecs.parse_varuint(data, done)
-                namelen, done = valuecodecs.parse_varuint(data, done)
-                name = data[done:done+namelen]
-                done += namelen
-                item = ItemDirectory(dirid, parent, name)
-                if itemtype == 0x92:
-                    extra_data, done = valuecodecs.parse_varuint(data, done)
-                    item.set_extra_data(extra_data)
-                itemdata = data[start:done]
-            elif data[done] in (0x91, 0x93, 0x94):
-                itemtype = data[done]
-                done += 1
-                parent, done = valuecodecs.parse_varuint(data, done)
-                namelen, done = valuecodecs.parse_varuint(data, done)
-                name = data[done:done+namelen]
-                done += namelen
-                cidlen, done = valuecodecs.parse_varuint(data, done)
-                cid = data[done:done+cidlen]
-                done += cidlen
-                filesize, done = valuecodecs.parse_varuint(data, done)
-                mtime_year = data[done] + data[done+1] * 256
-                mtime_second = (
-                    data[done+2] + data[done+3] * 0x100 +
-                    data[done+4] * 0x10000)
-                if data[done+5] >= 0x80:
-                    mtime_second += 0x1000000
-                mtime_ns = (
-                    (data[done+5] & 0x3f) + data[done+6] * 0x40 +
-                    data[done+7] * 0x4000 + data[done+8] * 0x400000)
-                done += 9
-                if itemtype in (0x91, 0x93):
-                    item = ItemFile(
-                        parent, name, cid, filesize,
-                        (mtime_year, mtime_second, mtime_ns))
-                elif itemtype == 0x94:
-                    ftype = self._filetypechars.get(data[done])
-                    if ftype is None:
-                        raise AssertionError(
-                            'Unknown filetype: ' + str(data[done]))
-                    done += 1
-                    item = ItemSpecialFile(
-                        ftype, parent, name, cid, filesize,
-                        (mtime_year, mtime_second, mtime_ns))
-                else:
-                    raise AssertionError('unreachable')
-                if itemtype in (0x93, 0x94):
-                    extra, done = valuecodecs.parse_varuint(data, done)
-                    item.set_extra_data(extra)
-                itemdata = data[start:done]
-            elif data[done] == 0x21:
-                done += 1
-                length, done = valuecodecs.parse_varuint(data, done)
-                end = done + length
-                kvid, done = valuecodecs.parse_varuint(data, done)
-                kv = data[done:end]
-                done = end
-                key, value = kv.split(b':', 1)
-                item = ItemKeyValue(kvid, key, value)
-                itemdata = data[start:done]
-            elif data[done] == 0x22:
-                done += 1
-                length, done = valuecodecs.parse_varuint(data, done)
-                end = done + length
-                xid, done = valuecodecs.parse_varuint(data, done)
-                kvids = []
-                while done < end:
-                    kvid, done = valuecodecs.parse_varuint(data, done)
-                    kvids.append(kvid)
-                assert done == end
-                item = ItemExtraDef(xid, tuple(kvids))
-                itemdata = data[start:done]
-            elif data[done] == 0:
-                if data[done:size].strip(b'\x00'):
+            decoder = decoders[data[done]]
+            if decoder is None:
+                if data[done] != 0:
+                    raise InvalidDataError('Unknown data item')
+                if data.count(0, done, size) != size - done:
                     raise InvalidDataError('Trailing garbage')
-                done = size
-            else:
-                raise InvalidDataError('Unknown data item')
-            if item is not None:
-                block._items.append((itemdata, item))
-                block._datasize += len(itemdata)
+                break
+            item, done = decoder(self, data, done)
+            items.append(item)
+        block._data = bytearray(data[:done])
         return block
 
     def create_empty_block(self, blockdatasize):
         block = BackupBlock()
         block.set_blockdatasize(blockdatasize)
         return block
+
+# The handlers hold no state, so every DataFile shares the same ones.
+_magic_handlers = {
+    b'ebakup database v1': MainHandler(),
+    b'ebakup content data': ContentHandler(),
+    b'ebakup backup data': BackupHandler(),
+}
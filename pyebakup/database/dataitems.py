@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 
+# All the item classes use __slots__, since a large data file can
+# produce a lot of them.
+
 class Item(object):
+    __slots__ = ('kind', 'key', 'value', 'kvid', 'xid', 'kvids')
+
     def __init__(self, kind):
         self.kind = kind
 
@@ -31,6 +36,8 @@ def ItemExtraDef(xid, kvids):
     return item
 
 class ItemDirectory(object):
+    __slots__ = ('kind', 'dirid', 'parent', 'name', 'extra_data')
+
     def __init__(self, dirid, parent, name):
         self.kind = 'directory'
         self.dirid = dirid
@@ -42,6 +49,10 @@ class ItemDirectory(object):
         self.extra_data = xid
 
 class ItemFile(object):
+    __slots__ = (
+        'kind', 'parent', 'name', 'cid', 'size',
+        'mtime_year', 'mtime_second', 'mtime_ns', 'extra_data')
+
     def __init__(self, parent, name, cid, size, mtime):
         self.kind = 'file'
         self.parent = parent
@@ -57,6 +68,8 @@ class ItemFile(object):
         self.extra_data = xid
 
 class ItemSpecialFile(ItemFile):
+    __slots__ = ()
+
     def __init__(self, filetype, parent, name, cid, size, mtime):
         if filetype not in ('symlink', 'socket', 'pipe', 'device', 'unknown'):
             raise AssertionError('Unhandled file type: ' + filetype)
@@ -64,6 +77,8 @@ class ItemSpecialFile(ItemFile):
         self.kind = 'file-' + filetype
 
 class ItemContent(object):
+    __slots__ = ('kind', 'cid', 'checksum', 'first')
+
     def __init__(self, cid, checksum, first):
         self.kind = 'content'
         self.cid = cid
@@ -4,19 +4,18 @@
 # in the database and plain python values.
 
 import datetime
+import struct
 
+_unpack_uint32 = struct.Struct('<I').unpack_from
 def parse_uint32(data, done):
-    return (data[done] + data[done+1] * 256 +
-            data[done+2] * 0x10000 + data[done+3] * 0x1000000)
+    return _unpack_uint32(data, done)[0]
 
 def make_uint32(value):
     if value < 0:
         raise ValueError('Can not make uint32 from negative number')
     if value > 0xffffffff:
         raise ValueError('Value too big for uint32: ' + str(value))
-    return bytes((
-        value & 0xff, (value >> 8) & 0xff,
-        (value >> 16) & 0xff, (value >> 24) & 0xff))
+    return value.to_bytes(4, 'little')
 
 def parse_varuint(data, done):
     if data[done] < 0x80:
@@ -34,11 +33,12 @@ def parse_varuint(data, done):
             return value, done + 1
         done += 1
 
+_single_byte_varuints = tuple(bytes((x,)) for x in range(0x80))
 def make_varuint(value):
     if value < 0:
         raise ValueError('Can not make varuint from negative number')
-    if value == 0:
-        return b'\x00'
+    if value < 0x80:
+        return _single_byte_varuints[value]
     data = []
     while value > 0x7f:
         data.append((value & 0x7f) | 0x80)
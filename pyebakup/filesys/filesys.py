@@ -188,6 +188,18 @@ class FileInterface(object):
         is returned.
         '''
 
+    def sync_data(self):
+        '''Wait until all data written to the file has reached the
+        physical medium.
+
+        Only the file's data is guaranteed to be synced. Metadata that
+        is not needed to read the data back (like the modification
+        time) may still be pending.
+
+        Only valid for regular files. Raises AttributeError() if
+        called on special files.
+        '''
+
     def lock_for_reading(self):
         '''Take a read lock on the file.
 
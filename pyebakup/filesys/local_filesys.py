@@ -74,23 +74,27 @@ class LocalFileSystem(object):
 
     def get_directory_listing(self, path, include_special_files=True):
         stringpath = self.path_to_string(path)
-        names = os.listdir(stringpath)
         dirs = []
         files = []
-        for name in names:
-            st = os.lstat(os.path.join(stringpath, name))
-            if stat.S_ISLNK(st.st_mode):
-                if (include_special_files):
-                    files.append((st.st_ino, name))
-            elif stat.S_ISDIR(st.st_mode):
-                dirs.append(name)
-            elif stat.S_ISREG(st.st_mode):
-                files.append((st.st_ino, name))
-            elif stat.S_ISSOCK(st.st_mode) or stat.S_ISFIFO(st.st_mode):
-                if (include_special_files):
-                    files.append((st.st_ino, name))
-            else:
-                raise AssertionError('Unknown file type: ' + name)
+        # scandir() usually knows the file type and inode number from
+        # the directory listing itself, so most entries need no stat().
+        with os.scandir(stringpath) as entries:
+            for entry in entries:
+                name = entry.name
+                if entry.is_symlink():
+                    if (include_special_files):
+                        files.append((entry.inode(), name))
+                elif entry.is_dir(follow_symlinks=False):
+                    dirs.append(name)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append((entry.inode(), name))
+                else:
+                    mode = entry.stat(follow_symlinks=False).st_mode
+                    if stat.S_ISSOCK(mode) or stat.S_ISFIFO(mode):
+                        if (include_special_files):
+                            files.append((entry.inode(), name))
+                    else:
+                        raise AssertionError('Unknown file type: ' + name)
         files.sort()
         files = tuple(x[1] for x in files)
         return dirs, files
@@ -277,6 +281,14 @@ class LocalFile(object):
         assert amt == len(data)
         return start + amt
 
+    def sync_data(self):
+        assert self._writable
+        self._open()
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(self._openfile.fileno())
+        else:
+            os.fsync(self._openfile.fileno())
+
     def get_backup_extra_data(self):
         st = self._lstat()
         access = stat.S_IMODE(st.st_mode)
@@ -108,6 +108,19 @@ class TestBackupInfo(unittest.TestCase):
         self.assertEqual('file', info.filetype)
         self.assertEqual({}, info.extra_data)
 
+    def test_file_info_is_read_only(self):
+        info = self.bk.get_file_info(('path', 'to', 'file',))
+        for name in (
+                'parentid', 'contentid', 'size', 'mtime', 'mtime_nsec',
+                'filetype', 'extra_data'):
+            self.assertRaises(AttributeError, setattr, info, name, None)
+        info.extra_data['owner'] = 'someone'
+        info = self.bk.get_file_info(('path', 'to', 'file',))
+        self.assertEqual(7850, info.size)
+        self.assertEqual(
+            datetime.datetime(2015, 2, 20, 12, 53, 22, 765430), info.mtime)
+        self.assertEqual({}, info.extra_data)
+
     def test_get_dir_info_for_directory(self):
         info = self.bk.get_dir_info(('path', 'to'))
         self.assertEqual({}, info.extra_data)
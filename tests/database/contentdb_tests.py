@@ -142,6 +142,19 @@ class TestContentDB(unittest.TestCase):
         self.assertEqual(firstseen, info.get_first_seen_time())
         self.assertEqual(cid, info.get_contentid())
 
+    def test_first_seen_time_before_and_after_reopen(self):
+        firstseen = datetime.datetime(2015, 5, 12, 6, 22, 57, 250000)
+        checksum = b'new content checksum'
+        cid = self.contentfile.add_content_item(firstseen, checksum)
+        info = self.contentfile.get_info_for_cid(cid)
+        self.assertEqual(firstseen, info.get_first_seen_time())
+        # The file only stores whole seconds
+        cf2 = contentdb.ContentInfoFile(self.db)
+        info = cf2.get_info_for_cid(cid)
+        self.assertEqual(
+            datetime.datetime(2015, 5, 12, 6, 22, 57),
+            info.get_first_seen_time())
+
     def test_add_two_items_with_same_checksum(self):
         firstseen = datetime.datetime(2015, 5, 12, 6, 22, 57)
         checksum = b'new content checksum'
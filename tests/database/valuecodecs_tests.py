@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 
 import datetime
+import struct
 import unittest
 
 import pyebakup.database.valuecodecs as valuecodecs
 
 class TestCodecs(unittest.TestCase):
+    def test_parse_uint32(self):
+        data = b'\x01\x02\x03\x04\xff\xff\xff\xff'
+        self.assertEqual(0x04030201, valuecodecs.parse_uint32(data, 0))
+        self.assertEqual(0xffffffff, valuecodecs.parse_uint32(data, 4))
+
+    def test_parse_uint32_fails_on_truncated_data(self):
+        data = b'\x01\x02\x03\x04\xff\xff\xff'
+        self.assertRaises(struct.error, valuecodecs.parse_uint32, data, 4)
+        self.assertRaises(struct.error, valuecodecs.parse_uint32, data, 7)
+
     def test_mtime_to_db_codec(self):
         encode = valuecodecs.make_mtime_with_nsec
         decode = lambda x: valuecodecs.parse_mtime(x, 0)
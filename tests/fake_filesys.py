@@ -454,6 +454,12 @@ class FakeFile(object):
             self._item.data[start + len(data):])
         return start + len(data)
 
+    def sync_data(self):
+        if not self._writable:
+            raise io.UnsupportedOperationError('write')
+        self._tree._check_access(self._path, 'write')
+        assert self._item.filetype == 'file'
+
     def close(self):
         if self._lock == 1:
             assert self._item.lock > 0